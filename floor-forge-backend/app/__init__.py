@@ -6,14 +6,39 @@ Flask application factory for FloorForge.
 """
 
 import os
+
+# Must be set before torch initializes CUDA - the allocator reads it once.
+# expandable_segments plus a larger split size handles fragmentation without
+# capping usable VRAM.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF",
+                      "max_split_size_mb:128,expandable_segments:True")
+
 import logging
-from flask import Flask, jsonify
+import threading
+from flask import Flask, Response, jsonify
 from flask_cors import CORS
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Process-level lock so gunicorn workers / repeated factory calls don't double-load the model
+_model_init_lock = threading.Lock()
+
+# Directories already created this process - skip repeat mkdir syscalls
+_ensured_dirs = set()
+
+def _ensure_directory(directory):
+    """Create a directory once per process."""
+    if directory in _ensured_dirs:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _ensured_dirs.add(directory)
+
+class OrjsonResponse(Response):
+    """Response class defaulting to JSON, for orjson-serialized byte bodies."""
+    default_mimetype = "application/json"
+
 def create_app(config_name):
     """
     Application factory function that creates and configures the Flask app.
@@ -25,29 +50,38 @@ def create_app(config_name):
         Flask: The configured Flask application
     """
     app = Flask(__name__, static_folder='static', static_url_path='/static')
-    
+    app.response_class = OrjsonResponse
+
     # Enable CORS
     CORS(app)
     
     # Load configuration based on environment
     app.config.from_object(f"app.config.{config_name.capitalize()}Config")
     
-    # Ensure required directories exist
+    # Ensure required directories exist (memoized per process)
     for directory in [
         app.config.get("GENERATED_IMAGES_DIR", "static/generated"),
         app.config.get("MODEL_BASE_DIR", "models"),
         app.config.get("CACHE_DIR", "cache")
     ]:
-        os.makedirs(directory, exist_ok=True)
+        _ensure_directory(directory)
     
     # Register global error handlers
     register_error_handlers(app)
     
     # Register blueprints
     register_blueprints(app)
-    
-    # Initialize model if eager loading is enabled
-    if app.config.get("EAGER_LOAD_MODEL", False):
+
+    # Cache hot-path config values in the service layer
+    from app.services.floor_plan_service import init_service
+    init_service(app)
+
+    # Initialize model at factory time so requests never pay the load cost.
+    # Only the main process loads - helper processes spawned via
+    # multiprocessing must not each initialize CUDA.
+    import multiprocessing
+    if (app.config.get("EAGER_LOAD_MODEL", True)
+            and multiprocessing.current_process().name == "MainProcess"):
         with app.app_context():
             initialize_model()
     
@@ -55,12 +89,26 @@ def create_app(config_name):
     @app.route("/health")
     def health_check():
         return jsonify({"status": "healthy", "service": "FloorForge API"})
-    
-    # Direct static route for images
-    @app.route('/api/static/<path:filename>')
-    def serve_static(filename):
-        return app.send_static_file(filename)
-    
+
+    # Readiness probe - 503 until the pipeline is loaded so orchestration
+    # only routes traffic once generation requests can actually be served
+    @app.route("/ready")
+    def readiness_check():
+        from app.stable_diffusion import model_loader
+        if model_loader._pipeline is None:
+            return jsonify({"status": "loading",
+                            "message": "Model has not finished loading"}), 503
+        return jsonify({"status": "ready"})
+    
+    # Static files are served by the reverse proxy in production; in
+    # development WhiteNoise serves them below the Flask routing layer
+    try:
+        from whitenoise import WhiteNoise
+        app.wsgi_app = WhiteNoise(app.wsgi_app, root=app.static_folder,
+                                  prefix="static/")
+    except ImportError:
+        pass
+
     # Print startup message
     logger.info(f"Starting FloorForge API in {config_name} mode")
     
@@ -70,11 +118,14 @@ def initialize_model():
     """Initialize the Stable Diffusion model."""
     try:
         import torch  # Import here to avoid issues if torch is not installed
-        
+
         from app.services.floor_plan_service import load_model
-        success = load_model()
+        with _model_init_lock:
+            success = load_model()
         
         if success:
+            # load_pipeline already ran its 1-step CUDA warmup (and
+            # deliberately skips warmup on CPU), so nothing more to do
             logger.info("Stable Diffusion model initialized!")
         else:
             logger.warning("Failed to initialize model - will attempt to load on first request")
@@ -6,8 +6,19 @@ Configuration settings for the FloorForge application.
 """
 
 import os
+import functools
 from datetime import timedelta
 
+@functools.lru_cache(maxsize=None)
+def _env_int(name, default):
+    """Read and convert an integer environment variable once."""
+    return int(os.getenv(name, default))
+
+@functools.lru_cache(maxsize=None)
+def _env_float(name, default):
+    """Read and convert a float environment variable once."""
+    return float(os.getenv(name, default))
+
 class BaseConfig:
     """Base configuration with common settings."""
     
@@ -24,30 +35,35 @@ class BaseConfig:
     BASE_MODEL_ID = "stabilityai/stable-diffusion-2-1-base"  # Fallback model if custom model not found
     
     # Model loading
-    EAGER_LOAD_MODEL = os.getenv("EAGER_LOAD_MODEL", "false").lower() == "true"
+    EAGER_LOAD_MODEL = os.getenv("EAGER_LOAD_MODEL", "true").lower() == "true"
+    ENABLE_INT8 = os.getenv("ENABLE_INT8", "false").lower() == "true"
     
+    # Batching settings
+    MAX_BATCH = _env_int("MAX_BATCH", "8")
+    MAX_BATCH_DELAY_MS = _env_int("MAX_BATCH_DELAY_MS", "25")
+
     # Inference settings
-    DEFAULT_NUM_INFERENCE_STEPS = int(os.getenv("DEFAULT_NUM_INFERENCE_STEPS", "10"))
-    DEFAULT_GUIDANCE_SCALE = float(os.getenv("DEFAULT_GUIDANCE_SCALE", "7.5"))
+    DEFAULT_NUM_INFERENCE_STEPS = _env_int("DEFAULT_NUM_INFERENCE_STEPS", "8")
+    DEFAULT_GUIDANCE_SCALE = _env_float("DEFAULT_GUIDANCE_SCALE", "7.5")
     DEFAULT_SEED = None  # Random seed by default
     
     # Image settings
-    DEFAULT_IMAGE_WIDTH = int(os.getenv("DEFAULT_IMAGE_WIDTH", "512"))
-    DEFAULT_IMAGE_HEIGHT = int(os.getenv("DEFAULT_IMAGE_HEIGHT", "512"))
+    DEFAULT_IMAGE_WIDTH = _env_int("DEFAULT_IMAGE_WIDTH", "512")
+    DEFAULT_IMAGE_HEIGHT = _env_int("DEFAULT_IMAGE_HEIGHT", "512")
+    IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "png").lower()  # "png" or "webp"
     
     # Cache settings
     CACHE_DIR = os.getenv("CACHE_DIR", "cache")
-    CACHE_TIMEOUT = int(os.getenv("CACHE_TIMEOUT", "3600"))  # 1 hour
+    CACHE_TIMEOUT = _env_int("CACHE_TIMEOUT", "3600")  # 1 hour
     
     # Image settings
     GENERATED_IMAGES_DIR = os.getenv("GENERATED_IMAGES_DIR", "static/generated")
     
-    # Ensure directories exist
     @classmethod
     def init_app(cls, app):
         """Initialize application with this configuration."""
-        for directory in [cls.MODEL_BASE_DIR, cls.CACHE_DIR, cls.GENERATED_IMAGES_DIR]:
-            os.makedirs(directory, exist_ok=True)
+        # Directory creation is handled (and memoized) by create_app
+        pass
 
 
 class DevelopmentConfig(BaseConfig):
@@ -56,10 +72,10 @@ class DevelopmentConfig(BaseConfig):
     DEBUG = True
     TESTING = False
     ENV = "development"
-    
-    # Shorter inference for faster development
-    DEFAULT_NUM_INFERENCE_STEPS = int(os.getenv("DEFAULT_NUM_INFERENCE_STEPS", "10"))
-    
+
+    # Even fewer steps for faster iteration in development
+    DEFAULT_NUM_INFERENCE_STEPS = _env_int("DEFAULT_NUM_INFERENCE_STEPS", "6")
+
     # Override init_app to include development-specific setup
     @classmethod
     def init_app(cls, app):
@@ -77,10 +93,7 @@ class TestingConfig(BaseConfig):
     DEBUG = False
     TESTING = True
     ENV = "testing"
-    
-    # Use minimal settings for tests
-    DEFAULT_NUM_INFERENCE_STEPS = 10
-    
+
     # Use temporary directory for test outputs
     GENERATED_IMAGES_DIR = os.getenv("GENERATED_IMAGES_DIR", "static/test-generated")
     
@@ -10,11 +10,14 @@ import uuid
 import time
 import json  # Add this import
 import logging
+import hashlib
+import functools
 import torch
-from flask import Blueprint, request, jsonify, current_app, url_for, send_from_directory
+from flask import Blueprint, request, current_app, url_for, send_from_directory
 
 # Import services
-from app.services.floor_plan_service import generate_floor_plan, load_model
+from app.services.floor_plan_service import generate_floor_plan
+from app.utils.helpers import jsonify_fast
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -22,6 +25,23 @@ logger = logging.getLogger(__name__)
 # Create a blueprint for floor plan routes
 floor_plan_bp = Blueprint("floor_plan", __name__)
 
+# On-disk cache of generation results for deterministic (seeded) requests
+_result_cache = None
+
+
+def _get_result_cache():
+    """Lazily open the diskcache result cache, or None if unavailable."""
+    global _result_cache
+
+    if _result_cache is None:
+        try:
+            import diskcache
+            _result_cache = diskcache.Cache(current_app.config["CACHE_DIR"])
+        except ImportError:
+            _result_cache = False  # Probed and unavailable
+
+    return _result_cache or None
+
 
 @floor_plan_bp.route("/generate-floor-plan", methods=["POST"])
 def create_floor_plan():
@@ -44,7 +64,7 @@ def create_floor_plan():
     
     # Validate input
     if not data or "prompt" not in data:
-        return jsonify({
+        return jsonify_fast({
             "error": "Bad Request",
             "message": "Missing required field: prompt"
         }), 400
@@ -53,7 +73,7 @@ def create_floor_plan():
     
     # Validate prompt
     if not prompt or not isinstance(prompt, str) or len(prompt.strip()) == 0:
-        return jsonify({
+        return jsonify_fast({
             "error": "Bad Request",
             "message": "Invalid prompt: must be a non-empty string"
         }), 400
@@ -65,17 +85,38 @@ def create_floor_plan():
                              current_app.config["DEFAULT_GUIDANCE_SCALE"])
     seed = data.get("seed")  # Allow None for random seed
     
+    # A fixed seed makes generation deterministic, so identical requests
+    # can be answered from the result cache instead of re-running diffusion
+    cache_key = None
+    if seed is not None:
+        cache_key = hashlib.blake2b(
+            f"{prompt}|{num_inference_steps}|{guidance_scale}|{seed}".encode(),
+            digest_size=16
+        ).hexdigest()
+        cache = _get_result_cache()
+        if cache is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                # The cache persists across restarts, so an entry can
+                # outlive the file it points to - only serve hits whose
+                # image is still on disk, and drop the stale ones
+                image_path = os.path.join(
+                    current_app.config["GENERATED_IMAGES_DIR"],
+                    os.path.basename(cached["imageUrl"]))
+                if os.path.exists(image_path):
+                    logger.info(f"Result cache hit for seeded prompt: '{prompt}'")
+                    return jsonify_fast(cached), 200
+                cache.delete(cache_key)
+
     try:
-        # Make sure model is loaded (this will be a no-op if already loaded)
-        load_model()
-        
         # Generate a unique ID for this floor plan
         floor_plan_id = str(uuid.uuid4())
         
         # Generate the floor plan - use the exact approach from Colab
+        image_format = current_app.config.get("IMAGE_FORMAT", "png")
         image_path, generation_time = generate_floor_plan(
             prompt=prompt,
-            output_filename=f"{floor_plan_id}.png",
+            output_filename=f"{floor_plan_id}.{image_format}",
             num_inference_steps=num_inference_steps,
             guidance_scale=guidance_scale,
             seed=seed
@@ -89,8 +130,8 @@ def create_floor_plan():
                            filename=image_filename, 
                            _external=True)
         
-        # Return the result
-        return jsonify({
+        # Build the result
+        result = {
             "id": floor_plan_id,
             "prompt": prompt,
             "imageUrl": image_url,
@@ -101,11 +142,21 @@ def create_floor_plan():
                 "seed": seed
             },
             "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-        }), 201
+        }
+
+        # Remember deterministic results for repeat requests; expire them
+        # on the configured horizon so entries don't outlive the images
+        if cache_key is not None:
+            cache = _get_result_cache()
+            if cache is not None:
+                cache.set(cache_key, result,
+                          expire=current_app.config["CACHE_TIMEOUT"])
+
+        return jsonify_fast(result), 201
         
     except Exception as e:
         logger.error(f"Error generating floor plan: {e}", exc_info=True)
-        return jsonify({
+        return jsonify_fast({
             "error": "Internal Server Error",
             "message": "Failed to generate floor plan"
         }), 500
@@ -125,7 +176,40 @@ def get_floor_plan_image(filename):
     # Use absolute path to ensure we can find the file
     generated_dir = os.path.abspath(current_app.config["GENERATED_IMAGES_DIR"])
     logger.info(f"Serving image from: {generated_dir}/{filename}")
-    return send_from_directory(generated_dir, filename)
+
+    # The writer pool may still be flushing a just-generated image;
+    # wait briefly for it to appear before giving up
+    file_path = os.path.join(generated_dir, filename)
+    deadline = time.time() + 2.0
+    while not os.path.exists(file_path) and time.time() < deadline:
+        time.sleep(0.05)
+
+    # Filenames are UUIDs so the content never changes - serve with an
+    # ETag and immutable cache headers so repeat fetches get 304s
+    response = send_from_directory(generated_dir, filename,
+                                   conditional=True, max_age=86400)
+    response.headers["Cache-Control"] = "public, max-age=86400, immutable"
+    response.add_etag()
+    response.make_conditional(request)
+    return response
+
+
+@functools.lru_cache(maxsize=4096)
+def _load_metadata(json_path, mtime_ns):
+    """
+    Load and cache floor plan metadata from a JSON file.
+
+    Keyed by (path, mtime) so an updated file busts its own cache entry.
+
+    Args:
+        json_path (str): Path to the metadata JSON file
+        mtime_ns (int): File modification time in nanoseconds
+
+    Returns:
+        dict: The parsed metadata
+    """
+    with open(json_path, 'r') as f:
+        return json.load(f)
 
 
 @floor_plan_bp.route("/floor-plans", methods=["GET"])
@@ -139,44 +223,48 @@ def list_floor_plans():
     # Get the directory where images are stored
     generated_dir = current_app.config["GENERATED_IMAGES_DIR"]
     
-    # Find all PNG files
+    # Find all PNG files in a single scandir pass (one syscall batch
+    # instead of listdir + exists + getmtime per file)
     floor_plans = []
     if os.path.exists(generated_dir):
-        for filename in os.listdir(generated_dir):
-            if filename.endswith(".png"):
+        with os.scandir(generated_dir) as it:
+            entries = {entry.name: entry for entry in it}
+
+        for filename, entry in entries.items():
+            if filename.endswith((".png", ".webp")):
                 # Check if there's a metadata file
                 base_name = os.path.splitext(filename)[0]
-                json_path = os.path.join(generated_dir, f"{base_name}.json")
-                
-                if os.path.exists(json_path):
+                json_entry = entries.get(f"{base_name}.json")
+
+                if json_entry is not None:
                     try:
-                        with open(json_path, 'r') as f:
-                            metadata = json.load(f)
-                            
-                            # Add image URL
-                            metadata["imageUrl"] = url_for('floor_plan.get_floor_plan_image', 
-                                                          filename=filename, 
-                                                          _external=True)
-                            
-                            floor_plans.append(metadata)
+                        # Copy so the cached dict isn't mutated below
+                        metadata = dict(_load_metadata(json_entry.path,
+                                                       json_entry.stat().st_mtime_ns))
+
+                        # Add image URL
+                        metadata["imageUrl"] = url_for('floor_plan.get_floor_plan_image',
+                                                      filename=filename,
+                                                      _external=True)
+
+                        floor_plans.append(metadata)
                     except Exception as e:
-                        logger.error(f"Error loading metadata from {json_path}: {e}")
+                        logger.error(f"Error loading metadata from {json_entry.path}: {e}")
                 else:
                     # Create basic metadata if JSON file doesn't exist
                     floor_plans.append({
                         "id": base_name,
-                        "imageUrl": url_for('floor_plan.get_floor_plan_image', 
-                                           filename=filename, 
+                        "imageUrl": url_for('floor_plan.get_floor_plan_image',
+                                           filename=filename,
                                            _external=True),
-                        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", 
-                                                 time.gmtime(os.path.getmtime(
-                                                     os.path.join(generated_dir, filename))))
+                        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                                 time.gmtime(entry.stat().st_mtime))
                     })
     
     # Sort by creation time (newest first)
     floor_plans.sort(key=lambda x: x.get("createdAt", ""), reverse=True)
     
-    return jsonify({"floorPlans": floor_plans}), 200
+    return jsonify_fast({"floorPlans": floor_plans}), 200
 
 
 @floor_plan_bp.route("/model-info", methods=["GET"])
@@ -192,7 +280,7 @@ def get_model_info():
         
         # Check if model is loaded
         if _pipeline is None:
-            return jsonify({
+            return jsonify_fast({
                 "status": "not_loaded",
                 "message": "Model has not been loaded yet"
             })
@@ -213,11 +301,11 @@ def get_model_info():
                 "max_gb": torch.cuda.get_device_properties(0).total_memory / 1e9
             }
         
-        return jsonify(info)
+        return jsonify_fast(info)
         
     except Exception as e:
         logger.error(f"Error getting model info: {e}")
-        return jsonify({
+        return jsonify_fast({
             "status": "error",
             "message": str(e)
         }), 500
\ No newline at end of file
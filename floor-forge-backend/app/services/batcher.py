@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Micro-batching scheduler for floor plan generation.
+
+Coalesces concurrent generation requests into a single batched
+Stable Diffusion call so the UNet forward pass is shared across
+requests instead of being serialized per Flask thread.
+"""
+
+import queue
+import random
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import torch
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Module-level scheduler instance (one per process)
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+# Pools of reusable torch.Generator objects, keyed by device string -
+# constructing one on CUDA allocates fresh cuRAND state, so recycle
+# them across batches
+_gen_pools = {}
+
+
+def _execution_device(pipeline):
+    """
+    Resolve the device inference actually runs on.
+
+    Under CPU offload pipeline.device can report meta/cpu even though
+    forwards execute on CUDA - generators must target the real device.
+    """
+    return getattr(pipeline, "_execution_device", pipeline.device)
+
+
+# LRU cache of prompt -> (prompt_embeds, negative_embeds). Floor plan
+# prompts repeat heavily, so cache hits skip the CLIP forward entirely;
+# misses still reuse the cached empty negative-prompt encode
+_embed_cache = OrderedDict()
+_EMBED_CACHE_SIZE = 1024
+
+
+def _get_prompt_embeds(pipeline, prompt):
+    """
+    Encode a prompt (and the empty negative prompt) through CLIP,
+    caching the result per prompt string.
+
+    Returns:
+        tuple: (prompt_embeds, negative_prompt_embeds)
+    """
+    cached = _embed_cache.get(prompt)
+    if cached is not None:
+        _embed_cache.move_to_end(prompt)
+        return cached
+
+    with torch.inference_mode():
+        if hasattr(pipeline, "encode_prompt"):
+            pos, neg = pipeline.encode_prompt(
+                prompt, _execution_device(pipeline), 1, True, negative_prompt=""
+            )
+        else:
+            # Older diffusers returns cat([negative, positive])
+            both = pipeline._encode_prompt(
+                prompt, _execution_device(pipeline), 1, True, negative_prompt=""
+            )
+            neg, pos = both.chunk(2)
+
+    _embed_cache[prompt] = (pos, neg)
+    while len(_embed_cache) > _EMBED_CACHE_SIZE:
+        _embed_cache.popitem(last=False)
+
+    return pos, neg
+
+
+def _acquire_generator(device, seed):
+    """Pop a pooled generator for the device (or allocate one) and seed it."""
+    pool = _gen_pools.setdefault(str(device), queue.LifoQueue())
+    try:
+        generator = pool.get_nowait()
+    except queue.Empty:
+        generator = torch.Generator(device=device)
+
+    if seed is not None:
+        generator.manual_seed(seed)
+    return generator
+
+
+def _release_generator(generator):
+    """Return a generator to its device pool for reuse."""
+    _gen_pools.setdefault(str(generator.device), queue.LifoQueue()).put(generator)
+
+
+class BatchScheduler:
+    """
+    Collects generation requests from concurrent threads and runs them
+    through the pipeline as a single batched call.
+
+    Requests are queued as (prompt, steps, guidance, seed, future) items.
+    A single background worker pulls up to max_batch items within a
+    max_delay_ms window, groups them by (steps, guidance), and resolves
+    each future with its generated image. Only matching pairs share a
+    pipeline call - every request runs at exactly the parameters it
+    asked for, and with per-sample generators the output is independent
+    of batch composition (which the result cache relies on).
+    """
+
+    def __init__(self, app, max_batch=8, max_delay_ms=25):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self.queue = queue.Queue()
+        # VAE decode runs on its own thread and CUDA stream so the worker
+        # can start the next batch's UNet loop while decode overlaps it
+        self.decoder = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix="vae-decode")
+        self._decode_stream = None
+        self.worker = threading.Thread(target=self._run, daemon=True,
+                                       name="batch-scheduler")
+        self.worker.start()
+
+    def submit(self, prompt, num_inference_steps, guidance_scale, seed):
+        """
+        Queue a generation request for the next batch.
+
+        Args:
+            prompt (str): The text prompt describing the floor plan
+            num_inference_steps (int): Number of inference steps
+            guidance_scale (float): Guidance scale for generation
+            seed (int, optional): Random seed for reproducibility
+
+        Returns:
+            concurrent.futures.Future: Resolves to the generated PIL image
+        """
+        future = Future()
+        self.queue.put((prompt, num_inference_steps, guidance_scale, seed, future))
+        return future
+
+    def _collect_batch(self):
+        """Block for the first item, then drain until max_batch or the delay window closes."""
+        import time
+
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _group_batch(self, batch):
+        """Partition drained items into groups with identical (steps, guidance)."""
+        groups = {}
+        for item in batch:
+            groups.setdefault((item[1], item[2]), []).append(item)
+        return list(groups.values())
+
+    def _run(self):
+        """Worker loop: pull batches off the queue and run them through the pipeline."""
+        while True:
+            batch = self._collect_batch()
+            # Coalescing mismatched requests into one call would run them
+            # at parameters nobody asked for, so each (steps, guidance)
+            # group gets its own pipeline call
+            for group in self._group_batch(batch):
+                try:
+                    with self.app.app_context():
+                        self._process_batch(group)
+                except Exception as e:
+                    logger.error(f"Batch generation failed: {e}", exc_info=True)
+                    for *_, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def _process_batch(self, batch):
+        """Run one batch through the pipeline and resolve its futures."""
+        # Import here to avoid paying the diffusers import at module load
+        from flask import current_app
+        from app.stable_diffusion.model_loader import get_pipeline
+
+        # The worker runs inside app_context, so when eager init failed
+        # and this is the lazy load, the configured pipeline path still
+        # wins over the loader's fallback locations
+        pipeline = get_pipeline(
+            pipeline_path=current_app.config.get("PIPELINE_PATH"),
+            model_id=current_app.config.get(
+                "BASE_MODEL_ID", "stabilityai/stable-diffusion-2-1-base")
+        )
+        if pipeline is None:
+            raise RuntimeError("Pipeline is not loaded")
+
+        prompts = [item[0] for item in batch]
+        # _run only ever hands us matching (steps, guidance) pairs
+        steps = batch[0][1]
+        guidance = batch[0][2]
+        device = _execution_device(pipeline)
+
+        # One generator per request; draw a random seed when none was given
+        # so seeded and unseeded requests can share a batch
+        generators = []
+        for _, _, _, seed, _ in batch:
+            if seed is None:
+                seed = random.randrange(2**32)
+            generators.append(_acquire_generator(device, seed))
+
+        logger.info(f"Running batch of {len(batch)} request(s) "
+                    f"with {steps} steps and guidance scale {guidance:.2f}")
+
+        # Overlapping decode with the next batch is only safe when the
+        # pipeline is fully resident - under offload the next __call__'s
+        # maybe_free_model_hooks() can move the VAE back to CPU while the
+        # decoder thread is mid-decode
+        gen_config = getattr(pipeline, "_gen_config", None)
+        resident = gen_config is not None and gen_config.offload == "none"
+        use_stream_decode = (resident
+                             and torch.cuda.is_available()
+                             and str(device).startswith("cuda"))
+
+        call_kwargs = dict(
+            num_inference_steps=steps,
+            guidance_scale=guidance,
+            generator=generators
+        )
+        if use_stream_decode:
+            # Stop at latents so VAE decode can run on a side stream
+            # while the worker collects the next batch
+            call_kwargs["output_type"] = "latent"
+
+        # Under classifier-free guidance, feed cached CLIP embeddings so
+        # repeated prompts (and the constant negative prompt) skip the
+        # text encoder
+        prompt_embeds = negative_embeds = None
+        if guidance > 1.0:
+            try:
+                embeds = [_get_prompt_embeds(pipeline, p) for p in prompts]
+                prompt_embeds = torch.cat([pos for pos, _ in embeds])
+                negative_embeds = torch.cat([neg for _, neg in embeds])
+            except Exception as e:
+                logger.warning(f"Prompt embedding cache failed, "
+                               f"falling back to raw prompts: {e}")
+
+        if prompt_embeds is not None:
+            call_kwargs["prompt_embeds"] = prompt_embeds
+            call_kwargs["negative_prompt_embeds"] = negative_embeds
+        else:
+            call_kwargs["prompt"] = prompts
+
+        try:
+            with torch.inference_mode():
+                output = pipeline(**call_kwargs)
+        finally:
+            for generator in generators:
+                _release_generator(generator)
+
+        if use_stream_decode:
+            self.decoder.submit(self._decode_and_resolve,
+                                pipeline, output.images, batch)
+        else:
+            for i, (*_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(output.images[i])
+
+    def _decode_and_resolve(self, pipeline, latents, batch):
+        """Decode latents on the side stream and resolve the batch futures."""
+        try:
+            images = self._decode_latents(pipeline, latents)
+            for i, (*_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(images[i])
+        except Exception as e:
+            logger.error(f"VAE decode failed: {e}", exc_info=True)
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _decode_latents(self, pipeline, latents):
+        """Run the VAE decode on a dedicated CUDA stream and return PIL images."""
+        if self._decode_stream is None:
+            self._decode_stream = torch.cuda.Stream()
+
+        done = torch.cuda.Event()
+
+        with torch.inference_mode():
+            # Don't start decoding until the UNet work that produced
+            # these latents has been issued on the default stream
+            self._decode_stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(self._decode_stream):
+                latents = latents / pipeline.vae.config.scaling_factor
+                image = pipeline.vae.decode(latents).sample
+                done.record()
+
+            # Synchronize only before pulling pixels back to the host
+            done.synchronize()
+            image = (image / 2 + 0.5).clamp(0, 1)
+            image = image.cpu().permute(0, 2, 3, 1).float().numpy()
+
+        return pipeline.numpy_to_pil(image)
+
+
+def get_scheduler():
+    """
+    Get the process-wide batch scheduler, creating it on first use.
+
+    Returns:
+        BatchScheduler: The scheduler instance
+    """
+    global _scheduler
+
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                from flask import current_app
+                app = current_app._get_current_object()
+                _scheduler = BatchScheduler(
+                    app,
+                    max_batch=app.config.get("MAX_BATCH", 8),
+                    max_delay_ms=app.config.get("MAX_BATCH_DELAY_MS", 25)
+                )
+                logger.info(f"Started batch scheduler (max_batch={_scheduler.max_batch}, "
+                            f"max_delay={_scheduler.max_delay * 1000:.0f}ms)")
+
+    return _scheduler
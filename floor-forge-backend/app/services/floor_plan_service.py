@@ -16,6 +16,28 @@ from app.stable_diffusion.inference import generate_floor_plan as generate_image
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Hot-path configuration cached at startup so per-request code skips
+# the current_app proxy walk
+_OUTPUT_DIR = None
+_DEFAULT_STEPS = None
+_DEFAULT_GUIDANCE = None
+
+def init_service(app):
+    """
+    Cache hot-path configuration values as module globals.
+
+    Called once from the application factory so generate_floor_plan
+    doesn't resolve current_app.config on every request.
+
+    Args:
+        app (Flask): The Flask application
+    """
+    global _OUTPUT_DIR, _DEFAULT_STEPS, _DEFAULT_GUIDANCE
+
+    _OUTPUT_DIR = app.config["GENERATED_IMAGES_DIR"]
+    _DEFAULT_STEPS = app.config["DEFAULT_NUM_INFERENCE_STEPS"]
+    _DEFAULT_GUIDANCE = app.config["DEFAULT_GUIDANCE_SCALE"]
+
 def load_model():
     """
     Load the Stable Diffusion model.
@@ -23,13 +45,8 @@ def load_model():
     Returns:
         bool: True if loaded successfully
     """
-    try:
-        # Use the inference module to load the model
-        success = load_inference_model()
-        return success
-    except Exception as e:
-        logger.error(f"Error loading model: {e}")
-        return False
+    # The inference module already logs and returns False on failure
+    return load_inference_model()
 
 def generate_floor_plan(
     prompt,
@@ -52,13 +69,21 @@ def generate_floor_plan(
         tuple: (image_path, generation_time)
     """
     try:
+        # Resolve defaults from the cached config values instead of
+        # hitting current_app.config per request
+        if num_inference_steps is None:
+            num_inference_steps = _DEFAULT_STEPS
+        if guidance_scale is None:
+            guidance_scale = _DEFAULT_GUIDANCE
+
         # Use the inference module to generate the floor plan
         return generate_image(
             prompt=prompt,
             output_filename=output_filename,
             num_inference_steps=num_inference_steps,
             guidance_scale=guidance_scale,
-            seed=seed
+            seed=seed,
+            output_dir=_OUTPUT_DIR
         )
     except Exception as e:
         logger.error(f"Error generating floor plan: {e}")
@@ -10,123 +10,91 @@ import time
 import json
 import uuid
 import logging
-import torch
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
-from diffusers import StableDiffusionPipeline
+from app.stable_diffusion.model_loader import get_pipeline
 from app.utils.helpers import ensure_directory, save_json, generate_timestamp
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Global variable to store the pipeline
-_pipeline = None
+# Dedicated writer pool so PNG encode + disk flush happen off the
+# request thread
+_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-writer")
+
+def _persist(image, output_path, metadata, metadata_path):
+    """
+    Write a generated image and its metadata to disk.
+
+    Runs on the writer pool so the request thread can respond as soon
+    as the image tensor is decoded.
+    """
+    try:
+        if output_path.endswith(".webp"):
+            # method=0 is the fastest WebP encoder setting and still
+            # beats PNG on size for diffusion outputs
+            image.save(output_path, "WEBP", quality=92, method=0)
+        else:
+            image.save(output_path, optimize=False, compress_level=1)
+        save_json(metadata, metadata_path)
+        logger.info(f"Saved floor plan to {output_path}")
+    except Exception as e:
+        logger.error(f"Error persisting floor plan to {output_path}: {e}")
 
 def load_model():
     """
-    Load the Stable Diffusion model.
-    
+    Load the Stable Diffusion model through the shared model_loader cache.
+
     Returns:
         bool: True if loaded successfully
     """
-    global _pipeline
-    
     try:
-        # Get the pipeline path from configuration
-        pipeline_path = current_app.config.get("PIPELINE_PATH")
-        base_model_id = current_app.config.get("BASE_MODEL_ID", "stabilityai/stable-diffusion-2-1-base")
-        
-        # Log the paths
-        logger.info(f"Attempting to load model from: {pipeline_path}")
-        logger.info(f"Fallback model ID: {base_model_id}")
-        
-        # Check if pipeline exists
-        if not os.path.exists(pipeline_path):
-            logger.warning(f"Custom model not found at {pipeline_path}, falling back to {base_model_id}")
-            model_path = base_model_id
-        else:
-            logger.info(f"Found custom model at {pipeline_path}")
-            model_path = pipeline_path
-        
-        # Check device
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Using device: {device}")
-        
-        # Set dtype based on device
-        dtype = torch.float16 if device == "cuda" else torch.float32
-        
-        # Load the pipeline
-        _pipeline = StableDiffusionPipeline.from_pretrained(
-            model_path,
-            torch_dtype=dtype,
-            safety_checker=None
+        pipeline = get_pipeline(
+            pipeline_path=current_app.config.get("PIPELINE_PATH"),
+            model_id=current_app.config.get("BASE_MODEL_ID", "stabilityai/stable-diffusion-2-1-base")
         )
-        
-        # Move to device
-        _pipeline = _pipeline.to(device)
-        
-        # Apply basic optimizations
-        if device == "cuda":
-            _pipeline.enable_attention_slicing()
-            # Try to enable xformers if available
-            try:
-                _pipeline.enable_xformers_memory_efficient_attention()
-                logger.info("Enabled xformers memory efficient attention")
-            except:
-                logger.info("Xformers not available, using default attention")
-        
-        logger.info("Pipeline loaded successfully!")
-        return True
+        return pipeline is not None
     except Exception as e:
         logger.error(f"Error loading model: {e}")
         return False
 
-def get_pipeline():
-    """
-    Get the loaded pipeline or load it if not already loaded.
-    
-    Returns:
-        StableDiffusionPipeline: The loaded pipeline
-    """
-    global _pipeline
-    
-    if _pipeline is None:
-        load_model()
-    
-    return _pipeline
-
 def generate_floor_plan(
     prompt,
     output_filename=None,
     num_inference_steps=None,
     guidance_scale=None,
-    seed=None
+    seed=None,
+    output_dir=None
 ):
     """
     Generate a floor plan from a text prompt.
-    
+
     Args:
         prompt (str): The text prompt describing the floor plan
         output_filename (str, optional): Filename for the output image
         num_inference_steps (int, optional): Number of inference steps
         guidance_scale (float, optional): Guidance scale for generation
         seed (int, optional): Random seed for reproducibility
-        
+        output_dir (str, optional): Directory for the output image
+
     Returns:
         tuple: (image_path, generation_time)
     """
     # Set default values from configuration if not provided
     if num_inference_steps is None:
         num_inference_steps = current_app.config.get("DEFAULT_NUM_INFERENCE_STEPS", 50)
-    
+
     if guidance_scale is None:
         guidance_scale = current_app.config.get("DEFAULT_GUIDANCE_SCALE", 7.5)
-    
+
     # Set output filename if not provided
     if output_filename is None:
-        output_filename = f"{uuid.uuid4()}.png"
-    
+        image_format = current_app.config.get("IMAGE_FORMAT", "png")
+        output_filename = f"{uuid.uuid4()}.{image_format}"
+
     # Ensure the output directory exists
-    output_dir = current_app.config.get("GENERATED_IMAGES_DIR")
+    if output_dir is None:
+        output_dir = current_app.config.get("GENERATED_IMAGES_DIR")
     ensure_directory(output_dir)
     
     # Full path for the output image
@@ -140,37 +108,28 @@ def generate_floor_plan(
         # Start the timer
         start_time = time.time()
         
-        # Make sure the model is loaded
-        pipeline = get_pipeline()
-        
-        # Set up generator if seed provided
-        if seed is not None:
-            generator = torch.Generator(device=pipeline.device).manual_seed(seed)
-        else:
-            generator = None
-        
-        # Generate image
-        result = pipeline(
+        # Submit to the batch scheduler so concurrent requests share
+        # a single batched pipeline call
+        # (imported here to avoid a circular import with the batcher)
+        from app.services.batcher import get_scheduler
+
+        future = get_scheduler().submit(
             prompt=prompt,
             num_inference_steps=num_inference_steps,
             guidance_scale=guidance_scale,
-            generator=generator
+            seed=seed
         )
-        
-        # Get image from result
-        image = result.images[0]
-        
-        # Save the image
-        image.save(output_path)
-        
+
+        # Wait for the batch containing this request to complete
+        image = future.result(timeout=120)
+
         # Calculate generation time
         generation_time = time.time() - start_time
-        
+
         # Log the success
         logger.info(f"Floor plan generated in {generation_time:.2f} seconds")
-        logger.info(f"Saved to {output_path}")
-        
-        # Save metadata
+
+        # Build metadata
         metadata = {
             "prompt": prompt,
             "num_inference_steps": num_inference_steps,
@@ -180,11 +139,12 @@ def generate_floor_plan(
             "output_path": output_path,
             "timestamp": generate_timestamp()
         }
-        
-        # Save metadata to a JSON file
+
+        # Hand the PNG encode and metadata write to the writer pool so
+        # the response doesn't wait on disk
         metadata_path = os.path.splitext(output_path)[0] + ".json"
-        save_json(metadata, metadata_path)
-        
+        _writer.submit(_persist, image, output_path, metadata, metadata_path)
+
         return output_path, generation_time
         
     except Exception as e:
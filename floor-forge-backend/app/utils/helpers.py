@@ -10,12 +10,49 @@ import time
 import json
 import logging
 import base64
+import hashlib
 from io import BytesIO
+from collections import OrderedDict
 from PIL import Image
 
+# orjson serializes several times faster than stdlib json; fall back
+# silently when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pybase64 decodes with SIMD - several times faster than stdlib on
+# image-sized payloads; same interface, so alias the module
+try:
+    import pybase64 as _b64
+except ImportError:
+    _b64 = base64
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
+def jsonify_fast(obj):
+    """
+    Build a JSON response with orjson when available.
+
+    orjson emits bytes directly and skips the Python-level encode walk,
+    which matters for large payloads like the floor plan listing.
+
+    Args:
+        obj: JSON-serializable response data
+
+    Returns:
+        Response: The JSON response
+    """
+    from flask import current_app, jsonify
+
+    if orjson is None:
+        return jsonify(obj)
+
+    return current_app.response_class(orjson.dumps(obj),
+                                      mimetype="application/json")
+
 def ensure_directory(directory_path):
     """
     Ensure a directory exists, create it if it doesn't.
@@ -31,21 +68,47 @@ def ensure_directory(directory_path):
         logger.info(f"Created directory: {directory_path}")
     return directory_path
 
+# Encoded-image LRU keyed by pixel-content hash - identical outputs
+# (result-cache hits, repeated seeds) skip the PNG encode entirely
+_b64_cache = OrderedDict()
+_B64_CACHE_SIZE = 128
+
 def image_to_base64(image, format="PNG"):
     """
     Convert a PIL Image to a base64 encoded string.
-    
+
+    Results are cached by pixel-content hash, so re-encoding the same
+    image is a dictionary lookup.
+
     Args:
         image (PIL.Image): The image to convert
         format (str): The image format (PNG, JPEG, etc.)
-        
+
     Returns:
         str: Base64 encoded image string
     """
+    key = (hashlib.blake2b(image.tobytes(), digest_size=16).digest(),
+           image.size, image.mode, format)
+    cached = _b64_cache.get(key)
+    if cached is not None:
+        _b64_cache.move_to_end(key)
+        return cached
+
     buffered = BytesIO()
-    image.save(buffered, format=format)
+    if format.upper() == "PNG":
+        # Level 1 zlib is ~5x faster than the default level 6 and barely
+        # larger on noisy diffusion outputs
+        image.save(buffered, format=format, compress_level=1)
+    else:
+        image.save(buffered, format=format)
     img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    return f"data:image/{format.lower()};base64,{img_str}"
+    result = f"data:image/{format.lower()};base64,{img_str}"
+
+    _b64_cache[key] = result
+    while len(_b64_cache) > _B64_CACHE_SIZE:
+        _b64_cache.popitem(last=False)
+
+    return result
 
 def base64_to_image(base64_str):
     """
@@ -57,12 +120,24 @@ def base64_to_image(base64_str):
     Returns:
         PIL.Image: The decoded image
     """
-    # Remove the data URL prefix if present
-    if "base64," in base64_str:
-        base64_str = base64_str.split("base64,")[1]
-    
-    img_data = base64.b64decode(base64_str)
-    return Image.open(BytesIO(img_data))
+    # Remove the data URL prefix if present - startswith bounds the
+    # check to the header instead of scanning the whole payload. A
+    # comma-less data: string is left as-is so b64decode raises its
+    # usual error instead of an IndexError here
+    if base64_str.startswith("data:"):
+        _, sep, payload = base64_str.partition(",")
+        if sep:
+            base64_str = payload
+
+    buffer = BytesIO(_b64.b64decode(base64_str, validate=False))
+    try:
+        image = Image.open(buffer)
+        # Force the pixel decode now so the buffer can be released
+        # instead of living as long as the lazily-loading image would
+        image.load()
+    finally:
+        buffer.close()
+    return image
 
 def save_json(data, filepath):
     """
@@ -76,8 +151,13 @@ def save_json(data, filepath):
         bool: True if successful, False otherwise
     """
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        if orjson is not None:
+            # orjson writes bytes directly, skipping the text-encoder walk
+            with open(filepath, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(filepath, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
         return True
     except Exception as e:
         logger.error(f"Error saving JSON to {filepath}: {e}")
@@ -94,6 +174,11 @@ def load_json(filepath):
         dict: The loaded data, or None if loading failed
     """
     try:
+        if orjson is not None:
+            # One whole-file read parses faster than the chunked stdlib
+            # parser for anything metadata-sized
+            with open(filepath, 'rb') as f:
+                return orjson.loads(f.read())
         with open(filepath, 'r', encoding='utf-8') as f:
             return json.load(f)
     except Exception as e:
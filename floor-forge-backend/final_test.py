@@ -6,14 +6,20 @@ Final test script with memory management.
 """
 
 import os
-import gc
+
+# The loader parses its env toggles once at import, so force CPU mode
+# before model_loader comes in - same ordering rule as
+# CUDA_VISIBLE_DEVICES in run.py
+os.environ.setdefault("USE_GPU", "false")
+
 import torch
 import numpy as np
-from diffusers import StableDiffusionPipeline
 import time
 import uuid
 from PIL import Image
 
+from app.stable_diffusion.model_loader import get_pipeline
+
 def main():
     # Set up paths
     MODEL_DIR = "app/models/floor_plan_model"
@@ -22,14 +28,23 @@ def main():
     # Create output directory
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
-    # Force CPU mode
-    device = "cpu"
-    print(f"Using device: {device}")
-    
+    # CPU mode was forced at module top, before the loader import
+    print("Using device: cpu")
+
+    # Use every core and let oneDNN pick its fastest kernels
+    torch.set_num_threads(os.cpu_count())
+    torch.backends.mkldnn.enabled = True
+
+    # bf16 halves memory bandwidth and roughly doubles matmul throughput
+    # on CPUs with AVX512-BF16/AMX; stay fp32 everywhere else
+    use_bf16 = False
+    try:
+        use_bf16 = torch.cpu._is_avx512_bf16_supported()
+    except Exception:
+        pass
+    print(f"bf16 autocast: {'enabled' if use_bf16 else 'unsupported, using fp32'}")
+
     try:
-        # Force garbage collection
-        gc.collect()
-        
         # Load the pipeline with minimal settings
         print(f"Loading pipeline from {MODEL_DIR}")
         
@@ -40,21 +55,10 @@ def main():
             
         # Try to load the model
         try:
-            # Load with minimal settings
-            pipeline = StableDiffusionPipeline.from_pretrained(
-                MODEL_DIR,
-                torch_dtype=torch.float32,
-                safety_checker=None,
-                requires_safety_checker=False,
-                low_cpu_mem_usage=True
-            )
-            
-            # Move to CPU
-            pipeline = pipeline.to("cpu")
-            
-            # Enable memory efficient attention
-            pipeline.enable_attention_slicing(1)
-            
+            # Shared loader: module-level pipeline cache plus the
+            # centralized optimization settings
+            pipeline = get_pipeline(MODEL_DIR)
+
             print("Pipeline loaded successfully!")
             
             # Test generation
@@ -64,23 +68,20 @@ def main():
             # Start the timer
             start_time = time.time()
             
-            # Generate with minimal settings
-            with torch.no_grad():
-                # Force garbage collection before generation
-                gc.collect()
-                
-                # Generate with minimal settings
-                result = pipeline(
-                    prompt=prompt,
-                    num_inference_steps=1,  # Absolute minimum steps
-                    guidance_scale=1.0,     # Minimal guidance
-                    height=128,             # Very small size
-                    width=128               # Very small size
-                )
-                
-                # Force garbage collection after generation
-                gc.collect()
-            
+            # Generate with minimal settings - inference_mode also skips
+            # the version-counter/view tracking no_grad still pays for
+            with torch.inference_mode():
+                # Generate with minimal settings; autocast keeps any fp32
+                # stragglers on the bf16 path when the CPU supports it
+                with torch.autocast("cpu", dtype=torch.bfloat16, enabled=use_bf16):
+                    result = pipeline(
+                        prompt=prompt,
+                        num_inference_steps=1,  # Absolute minimum steps
+                        guidance_scale=1.0,     # Minimal guidance
+                        height=128,             # Very small size
+                        width=128               # Very small size
+                    )
+
             # Get image from result
             image = result.images[0]
             
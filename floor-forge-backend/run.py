@@ -6,6 +6,11 @@ Entry point for the FloorForge Flask application.
 """
 
 import os
+
+# CUDA reads this once at context init, so it must be set before the
+# app import pulls in torch; mutating it later is a silent no-op
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "0")
+
 from app import create_app
 
 # Create application instance using environment variable or default to development
@@ -6,11 +6,18 @@ Standalone script to test model loading and generation.
 """
 
 import os
+
+# The loader parses its env toggles once at import, so force CPU mode
+# before model_loader comes in - same ordering rule as
+# CUDA_VISIBLE_DEVICES in run.py
+os.environ.setdefault("USE_GPU", "false")
+
 import torch
-from diffusers import StableDiffusionPipeline
 import time
 import uuid
 
+from app.stable_diffusion.model_loader import get_pipeline
+
 def main():
     # Set up paths
     MODEL_DIR = "app/models/floor_plan_model"
@@ -19,9 +26,8 @@ def main():
     # Create output directory
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
-    # Force CPU mode
-    device = "cpu"
-    print(f"Using device: {device}")
+    # CPU mode was forced at module top, before the loader import
+    print("Using device: cpu")
     
     # Load the pipeline
     print(f"Loading pipeline from {MODEL_DIR}")
@@ -30,18 +36,9 @@ def main():
     if not os.path.exists(MODEL_DIR):
         raise ValueError(f"Model not found at {MODEL_DIR}")
     
-    # Load the pipeline
-    pipeline = StableDiffusionPipeline.from_pretrained(
-        MODEL_DIR,
-        torch_dtype=torch.float32,  # Use float32 for CPU
-        safety_checker=None
-    )
-    
-    # Move to device
-    pipeline = pipeline.to(device)
-    
-    # Apply basic optimizations
-    pipeline.enable_attention_slicing()
+    # Shared loader: module-level pipeline cache plus the centralized
+    # optimization settings
+    pipeline = get_pipeline(MODEL_DIR)
     print("Pipeline loaded successfully!")
     
     # Test generation
@@ -51,14 +48,16 @@ def main():
     # Start the timer
     start_time = time.time()
     
-    # Generate image with reduced size and steps
-    result = pipeline(
-        prompt=prompt,
-        num_inference_steps=5,  # Use minimal steps
-        guidance_scale=7.5,
-        height=256,  # Reduced size
-        width=256    # Reduced size
-    )
+    # Generate image with reduced size and steps, with autograd
+    # bookkeeping fully disabled
+    with torch.inference_mode():
+        result = pipeline(
+            prompt=prompt,
+            num_inference_steps=5,  # Use minimal steps
+            guidance_scale=7.5,
+            height=256,  # Reduced size
+            width=256    # Reduced size
+        )
     
     # Get image from result
     image = result.images[0]
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+WSGI entry point for running FloorForge under gunicorn.
+
+Use a single worker with a thread pool so concurrent requests feed the
+batch scheduler without duplicating the pipeline's VRAM footprint:
+
+    gunicorn -w 1 --threads 16 -k gthread --timeout 180 wsgi:app
+"""
+
+import os
+from app import create_app
+
+app = create_app(os.getenv("FLASK_CONFIG", "production"))